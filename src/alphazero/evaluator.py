@@ -1,15 +1,17 @@
 import logging
 import queue
-import tqdm
+import multiprocessing as mp
 import time
 import os
 import torch
 import torch.nn as nn
 
+from tqdm import tqdm
 from common import *
 from game.game import Game
 from game.board_translator import BoardTranslator
 from game.move_translator import MoveTranslator
+from inference import prepare_for_inference
 
 class Evaluator:
     """Receives proposed new models and plays out self.args.num_evaluate_games between the new model and the old model and accepts any model that wins self.evaluation_threshold fraction of games or higher. Models that are accepted are published back to the self play worker.
@@ -23,6 +25,7 @@ class Evaluator:
                  board_translator: BoardTranslator,
                  move_translator: MoveTranslator,
                  new_model_queue: queue.Queue,
+                 new_model_applied: mp.Event,
                  game: Game,
                  args: dict):
         self.device = device
@@ -31,33 +34,70 @@ class Evaluator:
         self.board_translator = board_translator
         self.move_translator = move_translator
         self.new_model_queue = new_model_queue
+        self.new_model_applied = new_model_applied
         self.game = game
         self.args = args
 
+        # Shape of a single encoded board and the most boards forwarded through one model at once (the games of one half of the evaluation)
+        self.input_shape = self.board_translator.shape()
+        self.max_batch_size = self.args.num_evaluate_games - self.args.num_evaluate_games // 2
+
+        # Encoded boards of every game, pinned buffers for the batches and legal action masks copied to the GPU, and CUDA streams
+        # (see __allocate_buffers()). Pinned memory does not survive being sent to another process and streams cannot be pickled,
+        # so they are created in the evaluator process rather than here.
+        self.boards = None
+        self.staging = None
+        self.legal_masks = None
+        self.streams = None
+
+        # Models prepared for inference, keyed on the id of the nn.Module they were built from. Only the current model's
+        # entry is kept between evaluations, so it is not prepared again until a new model is accepted.
+        self.inference_models = {}
+
     def start(self) -> None:
         """Start the evaluator. Checks for models in the new_model_queue and runs evaluate() to evaluate new models. If accepted, publishes the model to the accepted_model_queue.
         """
-        
+        # Put the initial model on the GPU here, in the evaluator process, so the parent's model stays on the CPU
+        self.current_model = self.current_model.to(self.device)
+
+        # The evaluator only runs inference, where TF32 precision is plenty for ranking moves. These are process-wide settings,
+        # so they are set here (in the evaluator process) rather than in __init__ (which runs in the parent process).
+        torch.set_float32_matmul_precision('high')
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+
+        # Let cuDNN pick the fastest (tensor core) convolution kernels for the evaluation batch shapes
+        torch.backends.cudnn.benchmark = True
+
+        # Allocate the pinned buffers and streams in this process
+        self.__allocate_buffers()
+
         while True:
-            # Check for new models in the queue
-            try:
-                new_model_candidate = self.new_model_queue.get(timeout = self.args.new_model_queue_timeout)
+            # Wait for a new model in the queue
+            new_model_candidate = self.new_model_queue.get()
 
-                # Put the new model candidate on the GPU
-                new_model_candidate = new_model_candidate.to(self.device)
+            # Put the new model candidate on the GPU
+            new_model_candidate = new_model_candidate.to(self.device)
 
-                logging.info("(evaluator): found new model candidate")
-            except queue.Empty:
-                # Keep checking the queue if it's empty
-                continue
+            logging.info("(evaluator): found new model candidate")
 
             # Evaluate the new model against the current model
-            if self.evaluate(self.current_model, new_model_candidate):
-                # If the new model passes evaluation, update the current model to the new model
-                self.current_model.load_state_dict(new_model_candidate.state_dict())
+            accepted = self.evaluate(self.current_model, new_model_candidate)
+
+            # Candidates are not reused, so drop their inference model (it is kept only if the candidate is accepted)
+            candidate_inference_model = self.inference_models.pop(id(new_model_candidate))
+
+            if accepted:
+                # If the new model passes evaluation, update the current model to the new model. The candidate is not used
+                # after this, so the current model can take over its tensors instead of copying them.
+                state_dict = new_model_candidate.state_dict()
+                self.current_model.load_state_dict(state_dict, assign = True)
+
+                # The current model now has the candidate's weights, so reuse the candidate's inference model
+                self.inference_models[id(self.current_model)] = candidate_inference_model
 
                 # Set the shared variable to the new model
-                self.shared_variables[MODEL_STATE_DICT] = new_model_candidate.state_dict()
+                self.shared_variables[MODEL_STATE_DICT] = state_dict
 
                 # Set the signal that new model has been accepted for both types of workers
                 self.shared_variables[SELF_PLAY_SIGNAL] = 1
@@ -67,9 +107,11 @@ class Evaluator:
                 num_self_play_workers = self.shared_variables[NUM_SELF_PLAY_WORKERS]
                 num_training_workers = self.shared_variables[NUM_TRAINING_WORKERS]
 
-                # Wait for all models to update their internal models before setting the flag back to 0
+                # Wait for all models to update their internal models before setting the flag back to 0. Workers set the event
+                # after decrementing their counter, so the counters are checked again every time the event is set.
                 while self.shared_variables[NUM_SELF_PLAY_WORKERS] > 0 and self.shared_variables[NUM_TRAINING_WORKERS] > 0:
-                    time.sleep(30)
+                    self.new_model_applied.wait()
+                    self.new_model_applied.clear()
 
                 # Unset the signals
                 self.shared_variables[SELF_PLAY_SIGNAL] = 0
@@ -80,73 +122,157 @@ class Evaluator:
                 self.shared_variables[NUM_TRAINING_WORKERS] = num_training_workers
 
                 # Save the accepted model
-                save_accepted_model(self.args.accepted_model_path, new_model_candidate)
+                save_accepted_model(self.args.accepted_model_path, state_dict)
+
+    def __allocate_buffers(self) -> None:
+        """Allocates the buffers and streams used by play_games(), if they have not been allocated yet.
+        """
+        if self.staging is not None:
+            return
+
+        # Encoded boards of every game, one row per game. Each row is advanced in place after every move of its game. The layout is
+        # channels_last (NHWC), which is what tensor core convolutions prefer.
+        self.boards = torch.empty((self.args.num_evaluate_games, *self.input_shape), memory_format = torch.channels_last)
+
+        # The boards of each batch are gathered into this pinned buffer so the batch can be copied to the GPU asynchronously
+        self.staging = torch.empty((self.args.num_evaluate_games, *self.input_shape), memory_format = torch.channels_last, pin_memory = self.device.type == 'cuda')
+
+        # Legal action masks are built into this pinned buffer, for the same reason
+        self.legal_masks = torch.empty((self.args.num_evaluate_games, self.game.getActionSize()), dtype = torch.bool, pin_memory = self.device.type == 'cuda')
+
+        # One stream for each of the two models being compared, so their forward passes can overlap (None runs on the default stream)
+        self.streams = [torch.cuda.Stream(self.device) for _ in range(2)] if self.device.type == 'cuda' else [None]
 
     def evaluate(self, current_model, new_model) -> bool:
-        """Plays the new model against the current model for self.args.num_evaluate_games. The old model will start self.args.num_evaluate_games / 2 games and the new model will start the same amount of games so both models experience both sides.G
+        """Plays the new model against the current model for self.args.num_evaluate_games. The old model will start self.args.num_evaluate_games / 2 games and the new model will start the same amount of games so both models experience both sides.
+
+        All games are played concurrently (see play_games()), so every step only needs one forward pass per model.
 
         Returns:
             bool: Returns True if the percentage of wins by the new model is equal to or larger than self.evaluation_threshold, else False.
         """
-        num_wins = 0
-        first_player = current_model
-        second_player = new_model
         halfway_point = self.args.num_evaluate_games // 2
-        for i in tqdm(range(self.args.num_evaluate_games), desc = "evaluating models"):
-            # Switch player order at halfway point
-            if i == halfway_point:
-                first_player, second_player = second_player, first_player
 
-            logging.info(f"(evaluator): playing game {i}")
+        # Build (or reuse) the inference versions of both models
+        current_player = self.__inference_model(current_model)
+        new_player = self.__inference_model(new_model)
 
-            # Play a game and get the result
-            result = self.play_game(first_player, second_player)
+        # The current model starts the first half of the games, the new model starts the second half
+        pairings = [(current_player, new_player)] * halfway_point + [(new_player, current_player)] * (self.args.num_evaluate_games - halfway_point)
+        results = self.play_games(pairings)
 
-            # Increment number of wins if new model wins as second player or if new model wins as first player
-            if (i < halfway_point and result == -1) or (i >= halfway_point and result == 1):
-                num_wins += 1
-            
+        # Count the games where the new model wins as second player or as first player
+        num_wins = results[:halfway_point].count(-1) + results[halfway_point:].count(1)
 
         return (num_wins / self.args.num_evaluate_games) >= self.args.evaluation_threshold
 
-    def play_game(self, first_player: nn.Module, second_player: nn.Module) -> int:
-        """Executes one episode of a game
-
-        Returns:
-            int: Returns 1 if first player has won, -1 if second player has won, and 0 if the game is tied.
+    def __inference_model(self, model: nn.Module):
+        """Gets the inference version of a model (see inference.prepare_for_inference()), building it on first use.
         """
-        # Start a new game
-        board = self.game.getInitBoard()
-
-        # Keep track of the current player
-        current_player = first_player
-        next_player = second_player
+        if id(model) not in self.inference_models:
+            self.inference_models[id(model)] = prepare_for_inference(model, self.device, self.input_shape, self.max_batch_size)
+        return self.inference_models[id(model)]
 
-        # Keep going while the game has not ended
-        while not self.game.getGameEnded(board):
-            # Let the current player make a move
-            tensor = self.board_translator.encode(board)
+    def play_games(self, pairings: list[tuple]) -> list[int]:
+        """Executes one episode of a game for each (first player, second player) pairing, all concurrently.
 
-            # Forward the tensor representation through the model to get the policy
-            policy, _ = current_player.forward(tensor)
+        Games are played in lockstep, one ply per step. Every step, the unfinished games are grouped by the player to move, and the encoded boards of each group are gathered into a single (B, C, H, W) batch and forwarded through that player in one pass. The move played in each game is the argmax of its policy over the legal actions. Each group runs on its own CUDA stream, so the forward passes of different players can overlap with each other and with encoding the next group.
 
-            # Sort the policy in descending order and get the indices
-            sorted_indices = policy.argsort(descending = True).flatten()
+        Args:
+            pairings (list[tuple]): (first player, second player) for each game
 
-            # Try the actions one by one until the legal action with the highest probability is found
-            action = None
-            for index in sorted_indices:
-                action = self.move_translator.decode(index)
-                if self.game.checkIfValid(board, action):
-                    break
-
-            # Get the next state
-            board = self.game.getNextState(board, action)
-
-            # Switch players
-            current_player, next_player = next_player, current_player
+        Returns:
+            list[int]: Result of each game; 1 if first player has won, -1 if second player has won, and 0 if the game is tied.
+        """
+        num_games = len(pairings)
+
+        # Allocate the buffers and streams if play_games() is run outside of start()
+        self.__allocate_buffers()
+
+        # Start new games
+        games = [self.game.getInitBoard() for _ in range(num_games)]
+        done = [self.game.getGameEnded(board) for board in games]
+
+        # Encode the starting boards
+        for g in range(num_games):
+            self.board_translator.encode(games[g], out = self.boards[g])
+
+        # Track how many games have finished
+        progress = tqdm(total = num_games, initial = sum(done), desc = "evaluating models")
+
+        # Keep going while any game has not ended
+        ply = 0
+        with torch.inference_mode(), torch.jit.optimized_execution(True):
+            while not all(done):
+                # Group the unfinished games by the player to move
+                groups = {}
+                for g in range(num_games):
+                    if not done[g]:
+                        player = pairings[g][ply % 2]
+                        groups.setdefault(id(player), (player, []))[1].append(g)
+
+                # Launch the forward pass of every group
+                launched = []
+                start = 0
+                for i, (player, group) in enumerate(groups.values()):
+                    # Gather the group's encoded boards into its own rows of the staging buffer. The previous step's copies out of the
+                    # buffer have finished by now, since their results were needed to pick the moves that produced these boards.
+                    rows = slice(start, start + len(group))
+                    start += len(group)
+                    batch = torch.index_select(self.boards, 0, torch.tensor(group), out = self.staging[rows])
+
+                    stream = self.streams[i % len(self.streams)]
+                    with torch.cuda.stream(stream):
+                        if stream is not None:
+                            stream.wait_stream(torch.cuda.default_stream(self.device))
+
+                        # Forward the batch through the player to get the policies (the player copies the batch to the device without blocking)
+                        policy, _ = player.forward(batch)
+
+                    launched.append((group, rows, stream, policy))
+
+                # Pick the most probable legal action of every game. The legal masks are built on the CPU while the forward passes run.
+                actions = []
+                for group, rows, stream, policy in launched:
+                    legal_masks = self.legal_masks[rows]
+                    for row, g in enumerate(group):
+                        self.game.getLegalMask(games[g], out = legal_masks[row])
+
+                    with torch.cuda.stream(stream):
+                        legal_masks = legal_masks.to(policy.device, non_blocking = True)
+                        best_actions = policy.masked_fill(~legal_masks, float('-inf')).argmax(dim = 1)
+
+                        # Copy the actions back to the CPU without blocking
+                        actions.append((group, best_actions.to('cpu', non_blocking = True)))
+
+                # Wait for all groups once, right before the actions are needed on the CPU
+                if self.device.type == 'cuda':
+                    torch.cuda.synchronize(self.device)
+
+                for group, best_actions in actions:
+                    for g, action in zip(group, best_actions.tolist()):
+                        # Get the next state
+                        games[g] = self.game.getNextState(games[g], action)
+                        done[g] = self.game.getGameEnded(games[g])
+                        if done[g]:
+                            progress.update(1)
+                        else:
+                            # Advance the game's encoded board, reusing the encoding of the previous board
+                            self.board_translator.encode_next(games[g], out = self.boards[g])
+
+                ply += 1
+
+        progress.close()
+
+        # At this point, all games have ended
+        return [self.__result(board) for board in games]
+
+    def __result(self, board) -> int:
+        """Converts the result of a finished game into an integer from the first player's perspective.
 
-        # At this point, the game has ended
+        Returns:
+            int: Returns 1 if first player has won, -1 if second player has won, and 0 if the game is tied.
+        """
         result = self.game.getResult(board)
         if result == "1-0": # White (first player) won
             return 1
@@ -155,7 +281,7 @@ class Evaluator:
         else:
             return 0
         
-def save_accepted_model(path, model):
+def save_accepted_model(path, state_dict):
     # Get the current timestamp
     now = time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime())
 
@@ -166,4 +292,4 @@ def save_accepted_model(path, model):
 
     # Save the model
     file_path = os.path.join(relative_dir, file_name)
-    torch.save(model.state_dict(), file_path)
\ No newline at end of file
+    torch.save(state_dict, file_path)
\ No newline at end of file
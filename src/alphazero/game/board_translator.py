@@ -14,17 +14,39 @@ class BoardTranslator(ABC):
         self.device = device
 
     @abstractmethod
-    def encode(self, board: any) -> torch.Tensor:
+    def encode(self, board: any, out: torch.Tensor = None) -> torch.Tensor:
         """ Encode a user/library defined board into a tensor.
 
         Args:
             move (any): 
+            out (torch.Tensor, optional): Pre-allocated tensor to write the encoding into (and return). Defaults to None, in which case a new tensor is allocated.
 
         Returns:
             torch.Tensor: Tensor representing the board state
         """
         pass
 
+    def encode_next(self, board: any, out: torch.Tensor) -> torch.Tensor:
+        """ Encode a board into a tensor that holds the encoding of the same game one move earlier. Translators whose encoding includes history can override this to reuse the previous encoding instead of encoding from scratch.
+
+        Args:
+            board (any): Board after the move
+            out (torch.Tensor): Encoding of the board before the move, overwritten with the encoding of the board after the move
+
+        Returns:
+            torch.Tensor: out
+        """
+        return self.encode(board, out = out)
+
+    @abstractmethod
+    def shape(self) -> tuple:
+        """ Get the shape of the tensors produced by encode(), without encoding a board.
+
+        Returns:
+            tuple: Shape of an encoded board
+        """
+        pass
+
     @abstractmethod
     def decode(self, board: torch.Tensor) -> any:
         """ Decode a board represented as a tensor into the user/library defined board instance
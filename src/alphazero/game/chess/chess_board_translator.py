@@ -1,5 +1,9 @@
 import torch
 import chess
+import chess.polyglot
+import numpy as np
+
+from collections import OrderedDict
 
 from game.board_translator import BoardTranslator
 
@@ -28,58 +32,155 @@ class ChessBoardTranslator(BoardTranslator):
         BoardTranslator (_type_): _description_
         
     """
-    def __init__(self, device: torch.device, k: int = 8):
+    def __init__(self, device: torch.device, k: int = 8, cache_size: int = 256):
         """Initialize this BoardTranslator instance.
 
         Args:
             k (int, optional): The number of recent board positions to be encoded. If the history from the current state < k, then the non-filled planes are zeroed out. Defaults to 8.
+            cache_size (int, optional): The number of encoded histories to keep around, so the history of a board can be built from the history of the board one move earlier. Defaults to 256.
         """
         super().__init__(device)
         self.k = k
 
-    def encode(self, board: chess.Board) -> torch.Tensor:
+        # Least recently used cache of encoded histories, keyed on the zobrist hash of the encoded position. Entries also
+        # keep the move stack of the encoded board, since the same position can be reached through different histories.
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def encode(self, board: chess.Board, out: torch.Tensor = None) -> torch.Tensor:
         """Encodes a chess board into [Silver et al.] representation. 
 
-        Pops the board states back k steps, encodes those board states in the orientation of the passed in board, and returns a (14 * k + 7) of that board state and its history back k steps.
+        If the history of the board one move earlier is cached, its time steps are shifted back by one and only the newest time step is encoded. Otherwise, pops the board states back k steps and encodes those board states in the orientation of the passed in board. Returns a (14 * k + 7) of that board state and its history back k steps.
 
         Args:
             board (chess.Board): Board to encode.
+            out (torch.Tensor, optional): (14 * k + 7, 8, 8) tensor to write the encoding into. Defaults to None, in which case a new tensor is allocated.
 
         Returns:
             torch.Tensor: (14 * k + 7) tensor describing the state of the game starting from the passed in board as well as the history k time steps back.
             
             Each time step t (with k total time steps) is encoded as a (14, 8, 8) plane, with the first 6 planes encoding the active player's pieces, the next 6 planes encoding the opponent player's pieces, and the last 2 places encoding two-fold and three-fold repetitions.
         """
-        history = torch.zeros(self.k, 14, 8, 8, device = self.device)
+        if out is None:
+            out = torch.empty(self.shape(), device = self.device)
+
+        # Write the history into the first 14 * k planes (viewed as k time steps), reusing the history of the previous board if possible
+        self.__encode_history(board, out[:14 * self.k].unflatten(0, (self.k, 14)))
+
+        # Add metadata about current board
+        self.__meta(board, out[14 * self.k:])
+
+        return out
 
-        # Move number is the counter for each turn (not for a pair of turns)
-        move_number = board.fullmove_number * 2 if board.turn == chess.WHITE else board.fullmove_number * 2 - 1
+    def encode_next(self, board: chess.Board, out: torch.Tensor) -> torch.Tensor:
+        """Encodes a chess board in place over the encoding of the same game one move earlier. The time steps in out are shifted back by one (dropping the oldest) and only the newest time step and the metadata are encoded.
 
-        # Copy the input board (we need to pop out the states to build up history)
-        copy_board = board.copy()
+        Args:
+            board (chess.Board): Board to encode.
+            out (torch.Tensor): (14 * k + 7, 8, 8) encoding of the board before its last move, overwritten with the encoding of board.
 
-        # Push into history
-        for i in range(min(self.k, move_number)):
-            self.__push_into_history(copy_board, history, i)
-            copy_board.pop()
+        Returns:
+            torch.Tensor: out
+        """
+        history = out[:14 * self.k].unflatten(0, (self.k, 14))
 
-        # Concatenate planes into (14 * k, 8, 8) tensor
-        history = torch.cat(torch.unbind(history, dim = 0), dim = 0)
+        # Shift the time steps back by one, oldest first, since the source and destination overlap
+        for t in range(self.k - 1, 0, -1):
+            history[t].copy_(history[t - 1])
+        self.__encode_single_board(board, out = history[0])
 
         # Add metadata about current board
-        meta = self.__meta(board)
+        self.__meta(board, out[14 * self.k:])
+
+        return out
+
+    def shape(self) -> tuple:
+        """Gets the shape of an encoded board.
+
+        Returns:
+            tuple: (14 * k + 7, 8, 8)
+        """
+        return (14 * self.k + 7, 8, 8)
+
+    def __encode_history(self, board: chess.Board, history: torch.Tensor) -> torch.Tensor:
+        """Writes the history of a board into a (k, 14, 8, 8) tensor, newest time step first.
 
-        # Concatenate history and metadata
-        ret = torch.cat([history, meta], dim = 0)
+        Args:
+            board (chess.Board): Board to encode the history of
+            history (torch.Tensor): (k, 14, 8, 8) tensor to write the board's last k time steps into
+
+        Returns:
+            torch.Tensor: The history tensor that was passed in
+        """
+        previous = None
+        if board.move_stack:
+            # Only the last move is needed to get back to the previous position
+            previous_board = board.copy(stack = 1)
+            previous_board.pop()
+            previous = self.__cached_history(previous_board, board.move_stack[:-1])
+
+        if previous is not None:
+            # Shift the previous history back one time step (dropping the oldest) and encode the newest time step
+            history[1:] = previous[:-1]
+            self.__encode_single_board(board, out = history[0])
+        else:
+            # Time steps before the start of the game are zeroed out
+            history.zero_()
+
+            # Number of positions available to encode (the current one plus one for each move played so far)
+            num_positions = len(board.move_stack) + 1
+
+            # Copy the input board (we need to pop out the states to build up history)
+            copy_board = board.copy()
+
+            # Push into history
+            for i in range(min(self.k, num_positions)):
+                if i > 0:
+                    copy_board.pop()
+                self.__push_into_history(copy_board, history, i)
+
+        # Cache a copy of the history so the next board in this game can reuse it. Once the cache is full, the tensor of the
+        # evicted entry is reused for the copy.
+        cached = None
+        if len(self.cache) >= self.cache_size:
+            _, (_, cached) = self.cache.popitem(last = False)
+
+        cached = history.clone() if cached is None else cached.copy_(history)
+
+        key = chess.polyglot.zobrist_hash(board)
+        self.cache[key] = (board.move_stack.copy(), cached)
+        self.cache.move_to_end(key)
+
+        return history
+
+    def __cached_history(self, board: chess.Board, move_stack: list[chess.Move]) -> torch.Tensor:
+        """Looks up the cached history of a board.
+
+        Args:
+            board (chess.Board): Board to look up (only its position is used)
+            move_stack (list[chess.Move]): Moves that led to the board
+
+        Returns:
+            torch.Tensor: (k, 14, 8, 8) history of the board, or None if it has not been cached
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self.cache.get(key)
 
-        return ret
+        # The position may have been cached after a different sequence of moves
+        if entry is None or entry[0] != move_stack:
+            return None
+
+        self.cache.move_to_end(key)
+        return entry[1]
     
     def __meta(self,
-               board: chess.Board) -> torch.Tensor:
+               board: chess.Board,
+               out: torch.Tensor = None) -> torch.Tensor:
         """Gets (7, 8, 8) tensor describing the metadata of the passed in board.
 
         Args:
             board (chess.Board): Board to encode metadata from
+            out (torch.Tensor, optional): (7, 8, 8) tensor to write the metadata into. Defaults to None, in which case a new tensor is allocated.
 
         Returns:
             torch.Tensor: (7, 8, 8) tensor describing metadata as so: 
@@ -91,7 +192,7 @@ class ChessBoardTranslator(BoardTranslator):
                 - 5: opponent player queenside castling rights
                 - 6: halfmove clock
         """
-        meta = torch.zeros(7, 8, 8, device = self.device)
+        meta = torch.empty(7, 8, 8, device = self.device) if out is None else out
 
         # Active player color
         meta[0, :, :] = int(board.turn)
@@ -124,40 +225,33 @@ class ChessBoardTranslator(BoardTranslator):
             i (int): index of where to put the board encoding; indexes into k.
 
         Returns:
-            torch.Tensor: Returns the new history tensor with the board encoding placed at the specified index.
+            torch.Tensor: Returns the history tensor with the board encoding placed at the specified index.
         """
-        board_tensor = self.__encode_single_board(board)
-
-        # Overwrite the oldest element in representation
-        history[i] = board_tensor
+        # Encode the board directly into its slot
+        self.__encode_single_board(board, out = history[i])
 
         return history
         
 
-    def __encode_single_board(self, board: chess.Board) -> torch.Tensor:
+    def __encode_single_board(self, board: chess.Board, out: torch.Tensor = None) -> torch.Tensor:
         """Encodes a single board into its representative Tensor.
 
         Args:
             board (chess.Board): Board to encode
+            out (torch.Tensor, optional): (14, 8, 8) tensor to write the encoding into. Defaults to None, in which case a new tensor is allocated.
 
         Returns:
             torch.Tensor: (14, 8, 8) tensor describing the state of the board, as above.
         """
-        tensor = torch.zeros(14, 8, 8, device = self.device)
-
-        for square, piece in board.piece_map().items():
-            rank, file = chess.square_rank(square), chess.square_file(square)
-            piece_type, color = piece.piece_type, piece.color
-
-            # The first 6 planes encode the pieces of the active player, and the following encode
-            # the pieces of the opponent. 
-            offset = 0 if color == chess.WHITE else 6
+        tensor = torch.empty(14, 8, 8, device = self.device) if out is None else out
 
-            # Chess enumerate piece types beginning with 1
-            idx = piece_type - 1
+        # The first 6 planes encode the pieces of the active player, and the following encode the pieces of the opponent.
+        # Each plane comes from a 64-bit bitboard where bit i is set if the piece is on square i (= rank * 8 + file).
+        masks = np.array([board.pieces_mask(piece_type, color) for color in (chess.WHITE, chess.BLACK) for piece_type in chess.PIECE_TYPES], dtype = '<u8')
 
-            # Place into tensor
-            tensor[idx + offset, rank, file] = 1 
+        # Unpack the bitboards (least significant bit first) into (12, 8, 8) planes and place into tensor
+        planes = np.unpackbits(masks.view(np.uint8), bitorder = 'little').reshape(12, 8, 8)
+        tensor[0:12] = torch.from_numpy(planes)
 
         # Repetition counters
         tensor[12, :, :] = board.is_repetition(2)
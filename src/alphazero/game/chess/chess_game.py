@@ -59,6 +59,24 @@ class ChessGame(Game):
         """
         return list(board.legal_moves)
 
+    def getLegalMask(self, board: chess.Board, out: torch.Tensor = None) -> torch.Tensor:
+        """Returns a mask over the action space marking the actions that are legal for the current player.
+
+        Args:
+            board (chess.Board): State of the board
+            out (torch.Tensor, optional): (4672) bool tensor to write the mask into. Defaults to None, in which case a new tensor is allocated.
+
+        Returns:
+            torch.Tensor: (4672) bool tensor that is True at the index of every legal action
+        """
+        if out is None:
+            out = torch.zeros(self.getActionSize(), dtype = torch.bool, device = self.device)
+        else:
+            out.zero_()
+
+        out[[self.move_translator.encode(move, board) for move in board.legal_moves]] = True
+        return out
+
     def getGameEnded(self, board):
         """Returns whether or not a passed in game is over
 
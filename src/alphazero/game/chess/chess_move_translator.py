@@ -5,6 +5,9 @@ import numpy as np
 from .utils import rotate, IndexedTuple, unpack, pack
 from game.move_translator import MoveTranslator
 
+# 73 move types from each of the 8 x 8 squares
+_NUM_ACTIONS = 73 * 8 * 8
+
 class ChessMoveTranslator(MoveTranslator):
     """Implements the move encoding from [Silver et al., 2017]
     Based on: https://github.com/iamlucaswolf/gym-chess/tree/master/gym_chess/alphazero/move_encoding
@@ -28,6 +31,18 @@ class ChessMoveTranslator(MoveTranslator):
         self.knightMovesTranslator = KnightMovesTranslator()
         self.underpromotionTranslator = UnderpromotionsTranslator()
 
+        # The action space is fixed, so decode every action once up front. Entries are (move, is_queen_move), or None for
+        # actions that move off the board. Queen promotions depend on the board, so they are added in decode().
+        self.actionTable = [self.__decode_without_board(action) for action in range(_NUM_ACTIONS)]
+
+        # Likewise, encode every move in the table once up front, keyed on (from square, to square, promotion). Queen promotions
+        # are encoded as queen moves, so they share the key (and action) of the move without a promotion.
+        self.actionIndex = {}
+        for entry in self.actionTable:
+            if entry is not None:
+                move, _ = entry
+                self.actionIndex[(move.from_square, move.to_square, move.promotion)] = int(self.__encode_without_board(move))
+
     def encode(self, move: chess.Move, board: chess.Board) -> int:
         """Encodes a chess.Move instance into a corresponding action integer.
 
@@ -43,13 +58,8 @@ class ChessMoveTranslator(MoveTranslator):
             int: Returns a int describing an index in a flattened (73, 8, 8) tensor, as above. Notice that the mapping from move to integer is not the same for different orientations.
         """
 
-        action = self.queenMovesTranslator.encode(move, board)
-        
-        if action is None:
-            action = self.knightMovesTranslator.encode(move, board)
-
-        if action is None:
-            action = self.underpromotionTranslator.encode(move, board)
+        promotion = None if move.promotion == chess.QUEEN else move.promotion
+        action = self.actionIndex.get((move.from_square, move.to_square, promotion))
 
         # Invalid move
         if action is None:
@@ -70,22 +80,11 @@ class ChessMoveTranslator(MoveTranslator):
         Returns:
             chess.Move: Move in the given orientation corresponding to the given action integer.
         """
-        move = self.queenMovesTranslator.decode(action, board)
+        entry = self.actionTable[action] if 0 <= action < _NUM_ACTIONS else None
+        if entry is None:
+            raise ValueError(f"{action} is not a valid action.")
 
-        is_queen_move = move is not None
-        
-        # Sequentially check all encodings
-        if not move:
-            move = self.knightMovesTranslator.decode(action, board)
-
-        if not move:
-            move = self.underpromotionTranslator.decode(action, board)
-
-        if not move:
-            raise ValueError(f"{move} is not a valid action.")
-        
-        # Decide if is a pawn move
-        pawn = board.piece_at(move.from_square).piece_type == chess.PAWN
+        move, is_queen_move = entry
 
         # Moving a pawn to the opponent's home rank with a queen move is automatically assumed to be a queen underpromotion.
         # Add this situation manually because the QueenMoves class has no access to board state or piece type
@@ -95,11 +94,55 @@ class ChessMoveTranslator(MoveTranslator):
             # We assume a promoting move if a pawn (or black OR white) has made it to the 7th or 0th rank, since pawns can't move backwards.
             is_promoting_move = to_rank == 7 or to_rank == 0
 
-            if pawn and is_promoting_move:
-                move.promotion = chess.QUEEN
+            # Decide if is a pawn move (the from square may be empty for actions that are illegal in this position)
+            if is_promoting_move and board.piece_type_at(move.from_square) == chess.PAWN:
+                # Table entries are shared, so return a new move instead of setting the promotion on the entry
+                return chess.Move(move.from_square, move.to_square, promotion = chess.QUEEN)
 
         return move
 
+    def __encode_without_board(self, move: chess.Move) -> int:
+        """Encodes a move without looking at the board, by sequentially checking all encodings.
+
+        Args:
+            move (chess.Move): Move to encode
+
+        Returns:
+            int: Action of the move, or None if the move cannot be encoded
+        """
+        action = self.queenMovesTranslator.encode(move, None)
+
+        if action is None:
+            action = self.knightMovesTranslator.encode(move, None)
+
+        if action is None:
+            action = self.underpromotionTranslator.encode(move, None)
+
+        return action
+
+    def __decode_without_board(self, action: int) -> tuple:
+        """Decodes an action without looking at the board, by sequentially checking all encodings.
+
+        Args:
+            action (int): Action to decode
+
+        Returns:
+            tuple: (move, is_queen_move), or None if the action moves a piece off the board
+        """
+        move = self.queenMovesTranslator.decode(action, None)
+        if move:
+            return move, True
+
+        move = self.knightMovesTranslator.decode(action, None)
+
+        if not move:
+            move = self.underpromotionTranslator.decode(action, None)
+
+        if not move:
+            return None
+
+        return move, False
+
 class QueenMovesTranslator(MoveTranslator):
     def __init__(self):
         self._TYPE_OFFSET = 0
@@ -241,7 +284,7 @@ class UnderpromotionsTranslator(MoveTranslator):
 
     def encode(self, move: chess.Move, board: chess.Board) -> int:
         from_rank, from_file, to_rank, to_file = unpack(move)
-        is_underpromotion = (move.promotion in self._PROMOTIONS and (from_rank == 6 and to_rank == 7) or (from_rank == 1 and to_rank == 0))
+        is_underpromotion = move.promotion in self._PROMOTIONS and ((from_rank == 6 and to_rank == 7) or (from_rank == 1 and to_rank == 0))
         if not is_underpromotion:
             return None
         
@@ -285,10 +328,18 @@ class UnderpromotionsTranslator(MoveTranslator):
         # print(direction)
         promotion = self._PROMOTIONS[promotion_idx]
 
-        to_rank = from_rank + 1
+        # White pawns promote from the 7th to the 8th rank, black pawns from the 2nd to the 1st
+        if from_rank == 6:
+            to_rank = 7
+        elif from_rank == 1:
+            to_rank = 0
+        else:
+            return None
         to_file = from_file + direction
 
         ret = pack(from_rank, from_file, to_rank, to_file)
+        if ret is None:
+            return None
         ret.promotion = promotion
 
         return ret
\ No newline at end of file
@@ -10,8 +10,11 @@ from typing import Any
 
 def pack(from_rank, from_file, to_rank, to_file):
     """
-    Convert move coordinates into a chess.Move instance
+    Convert move coordinates into a chess.Move instance, or None if any coordinate falls off the board
     """
+    if not all(0 <= c < 8 for c in (from_rank, from_file, to_rank, to_file)):
+        return None
+
     from_square = chess.square(from_file, from_rank)
     to_square = chess.square(to_file, to_rank)
     return chess.Move(from_square, to_square)
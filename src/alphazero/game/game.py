@@ -33,6 +33,10 @@ class Game:
     def getValidMoves(self, board) -> list[torch.Tensor]:
         pass
     
+    @abstractmethod
+    def getLegalMask(self, board, out: torch.Tensor = None) -> torch.Tensor:
+        pass
+    
     @abstractmethod
     def getGameEnded(self, board) -> bool:
         pass
@@ -0,0 +1,128 @@
+"""
+Prepares networks for inference-only workloads, like the games played by the evaluator. Prepared models keep the
+(policy, value) = model.forward(tensor) interface of the nn.Module they were built from, so callers do not need to know
+how they are run.
+"""
+
+import copy
+import torch
+import torch.nn as nn
+
+# The profiling executor needs one run to record shapes and another to run the optimized graph
+_NUM_WARMUP_RUNS = 2
+
+# Batch sizes captured as CUDA graphs, as fractions of the largest batch. Smaller batches are padded up to the nearest one.
+_GRAPH_BATCH_FRACTIONS = (1, 2, 4)
+
+def prepare_for_inference(model: nn.Module,
+                          device: torch.device,
+                          input_shape: tuple,
+                          max_batch_size: int):
+    """Prepares a model for inference. Returns a frozen TorchScript version of the model (see TorchScriptModel).
+
+    Args:
+        model (nn.Module): Model to prepare
+        device (torch.device): Device to run inference on
+        input_shape (tuple): Shape of a single (unbatched) encoded board
+        max_batch_size (int): Largest batch of boards that will be forwarded at once
+
+    Returns:
+        Callable with the same forward() signature as model.
+    """
+    model.eval()
+
+    return TorchScriptModel(model, device, input_shape, max_batch_size)
+
+class TorchScriptModel:
+    """Runs a frozen TorchScript version of a network. On GPUs the network runs in FP16 with channels_last inputs, which lets cuDNN use tensor core convolution kernels.
+
+    On GPUs the forward pass is also captured as a CUDA graph for a few fixed batch sizes (the largest batch, half of it, and a quarter of it).
+    Batches are padded up to the nearest captured size and run by replaying its graph, which launches every kernel of the network at once.
+
+    The network is copied before conversion, so the original model keeps its FP32 weights.
+    """
+    def __init__(self,
+                 model: nn.Module,
+                 device: torch.device,
+                 input_shape: tuple,
+                 max_batch_size: int):
+        self.device = device
+        model = copy.deepcopy(model).to(device).eval()
+
+        if device.type == 'cuda':
+            self.dtype = torch.float16
+            self.memory_format = torch.channels_last
+            model = model.to(dtype = self.dtype, memory_format = self.memory_format)
+        else:
+            self.dtype = torch.float32
+            self.memory_format = torch.contiguous_format
+
+        # Script and freeze the model once (freezing inlines the weights so the graph can be optimized around them)
+        self.model = torch.jit.freeze(torch.jit.script(model))
+
+        # Captured graphs, keyed on batch size: (static input, static policy, static value, graph)
+        self.graphs = {}
+
+        # The first calls to a scripted model profile and optimize the graph, so get them out of the way here
+        dummy = torch.zeros((max_batch_size, *input_shape))
+        with torch.inference_mode(), torch.jit.optimized_execution(True):
+            for _ in range(_NUM_WARMUP_RUNS):
+                self.forward(dummy)
+
+            if device.type == 'cuda':
+                self.__capture_graphs(input_shape, max_batch_size)
+
+    def __capture_graphs(self, input_shape: tuple, max_batch_size: int) -> None:
+        """Captures the forward pass as a CUDA graph for each batch size in _GRAPH_BATCH_FRACTIONS.
+
+        Replaying a graph reads its static input and overwrites its static outputs, so the outputs of a forward pass are only
+        valid until the next one. The graphs share one memory pool, since at most one of them runs at a time.
+        """
+        pool = torch.cuda.graph_pool_handle()
+
+        # Capture the largest batch first so the smaller graphs can reuse its memory
+        for batch_size in sorted({max(max_batch_size // fraction, 1) for fraction in _GRAPH_BATCH_FRACTIONS}, reverse = True):
+            static_input = torch.zeros((batch_size, *input_shape), device = self.device, dtype = self.dtype).to(memory_format = self.memory_format)
+
+            # Warm up at this batch size on a side stream, so profiling and cuDNN benchmarking are not captured into the graph
+            side_stream = torch.cuda.Stream(self.device)
+            side_stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(side_stream):
+                for _ in range(_NUM_WARMUP_RUNS):
+                    self.model(static_input)
+            torch.cuda.current_stream(self.device).wait_stream(side_stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph, pool = pool):
+                static_policy, static_value = self.model(static_input)
+
+            self.graphs[batch_size] = (static_input, static_policy, static_value, graph)
+
+        logging.info(f"(inference): captured CUDA graphs for batch sizes {sorted(self.graphs)}")
+
+    def forward(self, x: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """Runs a batch of encoded boards through the model, converting it to the model's device, precision, and memory format.
+
+        Args:
+            x (torch.Tensor): (B, *input_shape) batch of encoded boards
+
+        Returns:
+            tuple[torch.Tensor, torch.Tensor]: policy and value for each board in the batch
+        """
+        x = x.to(self.device, self.dtype, non_blocking = True, memory_format = self.memory_format)
+
+        # Use the smallest captured graph that fits the batch, if any
+        batch_size = len(x)
+        graph_batch_size = min((size for size in self.graphs if size >= batch_size), default = None)
+        if graph_batch_size is None:
+            return self.model(x)
+
+        # Copy the batch into the graph's input (rows past the batch are left as they are) and replay the graph on the current stream
+        static_input, static_policy, static_value, graph = self.graphs[graph_batch_size]
+        static_input[:batch_size].copy_(x)
+        graph.replay()
+
+        return static_policy[:batch_size], static_value[:batch_size]
+
+    def __call__(self, x: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        return self.forward(x)
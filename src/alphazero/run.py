@@ -54,7 +54,6 @@ if __name__ == "__main__":
         'capacity': 1024,
 
         # Queue timeouts
-        'new_model_queue_timeout': 300, # Check every 5 minutes
         'accepted_model_queue_timeout': 300, # 5 minutes
 
         # MCTS
@@ -117,10 +116,13 @@ if __name__ == "__main__":
     # Create new model queue
     new_model_queue = mp.Queue()
 
+    # Create event that workers set once they have updated to a newly accepted model
+    new_model_applied = mp.Event()
+
     # Create workers and evaluator
-    self_play_worker = SelfPlayWorker(device, shared_dict, game, replay_buffer, board_translator, move_translator, args)
-    training_worker = TrainingWorker(device, shared_dict, replay_buffer, new_model_queue, args)
-    evaluator = Evaluator(device, shared_dict, model, board_translator, move_translator, new_model_queue, game, args)
+    self_play_worker = SelfPlayWorker(device, shared_dict, game, replay_buffer, board_translator, move_translator, new_model_applied, args)
+    training_worker = TrainingWorker(device, shared_dict, replay_buffer, new_model_queue, new_model_applied, args)
+    evaluator = Evaluator(device, shared_dict, model, board_translator, move_translator, new_model_queue, new_model_applied, game, args)
 
     # Kick off threads for self-play, training, and evaluation
     self_play_process = mp.Process(target=self_play_worker.start)
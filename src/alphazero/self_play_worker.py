@@ -7,8 +7,9 @@ Based on: https://github.com/suragnair/alpha-zero-general/blob/master/Coach.py
 import logging
 import os
 import torch
-import tqdm
+import multiprocessing as mp
 
+from tqdm import tqdm
 from common import *
 from replay_buffer import ReplayBuffer
 from game import game
@@ -38,6 +39,7 @@ class SelfPlayWorker:
                  replay_buffer: ReplayBuffer,
                  board_translator: BoardTranslator,
                  move_translator: MoveTranslator,
+                 new_model_applied: mp.Event,
                  args: dict):
         """
         Initialize this worker.
@@ -59,6 +61,7 @@ class SelfPlayWorker:
         self.replay_buffer = replay_buffer
         self.board_translator = board_translator
         self.move_translator = move_translator
+        self.new_model_applied = new_model_applied
         self.args = args
 
     def start(self):
@@ -86,6 +89,9 @@ class SelfPlayWorker:
                 if i > 0:
                     self.shared_variables[NUM_SELF_PLAY_WORKERS] -= 1
 
+                    # Let the evaluator know this worker has updated
+                    self.new_model_applied.set()
+
                 # Set model to evaluation model
                 model.eval()
 
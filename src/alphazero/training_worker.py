@@ -5,6 +5,7 @@ Encapsulates worker to train the neural network based on examples collected from
 import logging
 import torch
 import queue
+import multiprocessing as mp
 import torch.nn as nn
 
 from common import *
@@ -21,11 +22,13 @@ class TrainingWorker:
                  shared_variables: dict,
                  replay_buffer: ReplayBuffer,
                  new_model_queue: queue.Queue,
+                 new_model_applied: mp.Event,
                  args: dict):
         self.device = device
         self.shared_variables = shared_variables
         self.replay_buffer = replay_buffer
         self.new_model_queue = new_model_queue
+        self.new_model_applied = new_model_applied
         self.args = args
 
     def start(self):
@@ -56,6 +59,9 @@ class TrainingWorker:
                 # Decrement the counter for the number of workers that have updated the model
                 self.shared_variables[NUM_TRAINING_WORKERS] -= 1
 
+                # Let the evaluator know this worker has updated
+                self.new_model_applied.set()
+
                 # Set the optimizer for model
                 optimizer = torch.optim.SGD(model.parameters(), lr=self.args.learning_rate, momentum = self.args.momentum, weight_decay = 1e-4)
 
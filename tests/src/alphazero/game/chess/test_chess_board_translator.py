@@ -7,55 +7,16 @@ device = torch.device("cpu")
 
 translator = ChessBoardTranslator(device)
 
-def assert_board_state_pre_view(tensor, i):
-    # Pawns
-    assert(torch.sum(tensor[i][0]) == 8)
-    assert(torch.sum(tensor[i][6]) == 8)
-
-    # Knight
-    assert(torch.sum(tensor[i][1]) == 2)
-    assert(torch.sum(tensor[i][7]) == 2)
-
-    # Bishop
-    assert(torch.sum(tensor[i][2]) == 2)
-    assert(torch.sum(tensor[i][8]) == 2)
-
-    # Rook
-    assert(torch.sum(tensor[i][3]) == 2)
-    assert(torch.sum(tensor[i][9]) == 2)
-
-    # King
-    assert(torch.sum(tensor[i][4]) == 1)
-    assert(torch.sum(tensor[i][10]) == 1)
+# Number of each piece per player in the starting position, in plane order: pawns, knights, bishops, rooks, queen, king
+expected_piece_counts = torch.tensor([8, 2, 2, 2, 1, 1] * 2, dtype = torch.float)
 
-    # Queen
-    assert(torch.sum(tensor[i][5]) == 1)
-    assert(torch.sum(tensor[i][11]) == 1)
+def assert_board_state_pre_view(tensor, i):
+    # Piece counts of all 12 piece planes of time step i
+    assert(torch.equal(tensor[i, :12].flatten(1).sum(dim = 1), expected_piece_counts))
 
 def assert_board_state_post_view(tensor, i):
-    # Pawns
-    assert(torch.sum(tensor[14 * i]) == 8)
-    assert(torch.sum(tensor[14 * i + 6]) == 8)
-
-    # Knight
-    assert(torch.sum(tensor[14 * i + 1]) == 2)
-    assert(torch.sum(tensor[14 * i + 7]) == 2)
-
-    # Bishop
-    assert(torch.sum(tensor[14 * i + 2]) == 2)
-    assert(torch.sum(tensor[14 * i + 8]) == 2)
-
-    # Rook
-    assert(torch.sum(tensor[14 * i + 3]) == 2)
-    assert(torch.sum(tensor[14 * i + 9]) == 2)
-
-    # King
-    assert(torch.sum(tensor[14 * i + 4]) == 1)
-    assert(torch.sum(tensor[14 * i + 10]) == 1)
-
-    # Queen
-    assert(torch.sum(tensor[14 * i + 5]) == 1)
-    assert(torch.sum(tensor[14 * i + 11]) == 1)
+    # Piece counts of all 12 piece planes of time step i
+    assert(torch.equal(tensor[14 * i:14 * i + 12].flatten(1).sum(dim = 1), expected_piece_counts))
 
 def test_push_into_history():
     tensor = torch.zeros((8, 14, 8, 8))
@@ -69,6 +30,24 @@ def test_push_into_history():
     tensor = translator._ChessBoardTranslator__push_into_history(board, tensor, 1)
     assert_board_state_pre_view(tensor, 1)
 
+def test_encode_single_board():
+    board = chess.Board()
+
+    # Play random moves to get pieces off their starting squares
+    for _ in range(20):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        board.push(random.choice(legal_moves))
+
+    tensor = translator._ChessBoardTranslator__encode_single_board(board)
+
+    # Every piece is in the plane for its type and color, and nothing else is set
+    assert(torch.sum(tensor[0:12]) == len(board.piece_map()))
+    for square, piece in board.piece_map().items():
+        offset = 0 if piece.color == chess.WHITE else 6
+        assert(tensor[piece.piece_type - 1 + offset, chess.square_rank(square), chess.square_file(square)] == 1)
+
 def test_encode():
     board = chess.Board()
 
@@ -111,3 +90,53 @@ def test_encode():
     assert(torch.sum(tensor[113]) == 5 * 64)
 
     # can't assert casting rights and no progress counter (not sure because random)
+
+def test_shape():
+    assert(translator.shape() == tuple(translator.encode(chess.Board()).shape))
+    assert(ChessBoardTranslator(device, k = 4).shape() == (63, 8, 8))
+
+def test_encode_cached_history():
+    cached_translator = ChessBoardTranslator(device)
+    board = chess.Board()
+
+    # Encode every position of a game, so each encoding is built from the cached history of the previous one
+    for _ in range(20):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        board.push(random.choice(legal_moves))
+
+        # Encoding with a fresh translator (empty cache) builds the history from scratch
+        assert(torch.equal(cached_translator.encode(board), ChessBoardTranslator(device).encode(board)))
+
+def test_encode_cached_history_transposition():
+    cached_translator = ChessBoardTranslator(device)
+
+    # Reach the same position through two different move orders
+    board = chess.Board()
+    for move in ["g1f3", "g8f6", "d2d4"]:
+        board.push(chess.Move.from_uci(move))
+    cached_translator.encode(board)
+
+    transposed_board = chess.Board()
+    for move in ["d2d4", "g8f6", "g1f3"]:
+        transposed_board.push(chess.Move.from_uci(move))
+    cached_translator.encode(transposed_board)
+
+    # The history of the first move order must not be reused for the second
+    transposed_board.push(chess.Move.from_uci("e7e6"))
+    assert(torch.equal(cached_translator.encode(transposed_board), ChessBoardTranslator(device).encode(transposed_board)))
+
+def test_encode_next():
+    board = chess.Board()
+    encoding = ChessBoardTranslator(device).encode(board)
+
+    # Advance one encoding in place through a game; it must match encoding each position from scratch
+    for _ in range(20):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        board.push(random.choice(legal_moves))
+
+        translator.encode_next(board, out = encoding)
+        assert(torch.equal(encoding, ChessBoardTranslator(device).encode(board)))
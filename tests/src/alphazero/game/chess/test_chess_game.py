@@ -73,6 +73,22 @@ def test_getValidMoves():
         # make sure move is legal
         assert(board.is_legal(move))
 
+def test_getLegalMask():
+    # black to move, with a pawn that can promote
+    board = chess.Board('4k3/8/8/8/8/8/p7/4K3 b - - 0 1')
+
+    mask = chess_game.getLegalMask(board)
+    assert(mask.shape == (chess_game.getActionSize(),))
+
+    # exactly the legal moves are set, and each decodes back to its move
+    legal_actions = mask.nonzero().flatten().tolist()
+    assert(len(legal_actions) == board.legal_moves.count())
+    assert(set(move_translator.decode(action, board) for action in legal_actions) == set(board.legal_moves))
+
+    # writing into an existing tensor overwrites what was there
+    out = torch.ones(chess_game.getActionSize(), dtype = torch.bool)
+    assert(torch.equal(chess_game.getLegalMask(board, out = out), mask))
+
 def test_getGameEnded():
     board = chess.Board('4k3/4Q3/4K3/8/8/8/8/8 b - - 0 1')
     assert(chess_game.getGameEnded(board) == True)
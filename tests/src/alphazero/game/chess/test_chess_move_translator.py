@@ -69,4 +69,20 @@ def test_full_translation():
     move = chess.Move.from_uci("a7a8")
     move.promotion = chess.QUEEN
     idx = translator.encode(move, board)
-    assert(translator.decode(idx, board) == move)
\ No newline at end of file
+    assert(translator.decode(idx, board) == move)
+
+    # encode a black underpromotion
+    board = chess.Board('4k3/8/8/8/8/8/p7/4K3 b - - 0 1')
+    move = chess.Move.from_uci("a2a1n")
+    idx = translator.encode(move, board)
+    assert(translator.decode(idx, board) == move)
+
+def test_every_action_round_trips():
+    translator = ChessMoveTranslator(device)
+    board = chess.Board()
+
+    # every action that stays on the board decodes to a move that encodes back to the same action
+    for action, entry in enumerate(translator.actionTable):
+        if entry is not None:
+            move, _ = entry
+            assert(translator.encode(move, board) == action)
@@ -0,0 +1,123 @@
+import torch
+import chess
+
+from evaluator import Evaluator
+from game.chess.chess_game import ChessGame
+from game.chess.chess_model import AlphaZeroNetwork
+from game.chess.chess_board_translator import ChessBoardTranslator
+from game.chess.chess_move_translator import ChessMoveTranslator
+
+device = torch.device("cpu")
+board_translator = ChessBoardTranslator(device)
+move_translator = ChessMoveTranslator(device)
+
+class dotdict(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+class RecordingChessGame(ChessGame):
+    """Chess game that keeps the final board of every game the evaluator asks the result of."""
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.final_boards = []
+
+    def getResult(self, board: chess.Board):
+        self.final_boards.append(board)
+        return super().getResult(board)
+
+def make_args(num_evaluate_games, evaluation_threshold = 0.55):
+    return dotdict({
+        'num_evaluate_games': num_evaluate_games,
+        'evaluation_threshold': evaluation_threshold,
+    })
+
+def make_model(seed):
+    torch.manual_seed(seed)
+    return AlphaZeroNetwork(num_filters = 8, num_res_layers = 1).eval()
+
+def play_reference_game(game, first_player, second_player):
+    """Plays one game sequentially, encoding every board from scratch and forwarding it on its own."""
+    board = game.getInitBoard()
+    players = (first_player, second_player)
+    ply = 0
+    with torch.inference_mode():
+        while not game.getGameEnded(board):
+            encoded = ChessBoardTranslator(device).encode(board)
+            policy, _ = players[ply % 2](encoded.unsqueeze(0))
+
+            # Most probable action that decodes to a legal move
+            for action in policy[0].argsort(descending = True).tolist():
+                try:
+                    move = move_translator.decode(action, board)
+                except ValueError:
+                    continue
+                if board.is_legal(move):
+                    break
+
+            board = game.getNextState(board, action)
+            ply += 1
+    return board
+
+def test_play_games():
+    current_model = make_model(0)
+    new_model = make_model(1)
+
+    # Constructing the evaluator (in the parent process) encodes nothing, so nothing is cached in the translator
+    board_translator = ChessBoardTranslator(device)
+    game = RecordingChessGame(device, board_translator, move_translator)
+    evaluator = Evaluator(device, {}, current_model, board_translator, move_translator, None, None, game, make_args(5))
+    assert(len(board_translator.cache) == 0)
+
+    # Batches are sized for the larger half
+    assert(evaluator.max_batch_size == 3)
+
+    # Play an odd number of games between the inference versions of the models, paired as evaluate() does
+    current_player = evaluator._Evaluator__inference_model(current_model)
+    new_player = evaluator._Evaluator__inference_model(new_model)
+    pairings = [(current_player, new_player)] * 2 + [(new_player, current_player)] * 3
+    results = evaluator.play_games(pairings)
+
+    # Every game is played move for move like a sequential game between the same models
+    expected_boards = [play_reference_game(game, current_model, new_model)] * 2 + [play_reference_game(game, new_model, current_model)] * 3
+    assert(len(game.final_boards) == 5)
+    for board, expected_board in zip(game.final_boards, expected_boards):
+        assert(board.move_stack == expected_board.move_stack)
+
+    # Results are from the first player's perspective
+    expected_results = {"1-0": 1, "0-1": -1}
+    assert(results == [expected_results.get(board.result(), 0) for board in expected_boards])
+
+def test_evaluate():
+    current_model = make_model(0)
+    new_model = make_model(1)
+    game = ChessGame(device, board_translator, move_translator)
+
+    class CannedEvaluator(Evaluator):
+        """Evaluator whose games end with fixed results."""
+        def play_games(self, pairings):
+            self.pairings = pairings
+            return self.results
+
+    evaluator = CannedEvaluator(device, {}, current_model, board_translator, move_translator, None, None, game, make_args(4))
+    current_player = evaluator._Evaluator__inference_model(current_model)
+    new_player = evaluator._Evaluator__inference_model(new_model)
+
+    def evaluate(results):
+        evaluator.results = results
+        return evaluator.evaluate(current_model, new_model)
+
+    # The current model starts the first half of the games and the new model starts the second half
+    evaluate([0] * 4)
+    assert(evaluator.pairings == [(current_player, new_player)] * 2 + [(new_player, current_player)] * 2)
+
+    # The new model wins every game, as second player in the first half and as first player in the second half
+    assert(evaluate([-1, -1, 1, 1]) == True)
+
+    # The current model wins every game
+    assert(evaluate([1, 1, -1, -1]) == False)
+
+    # The new model wins one game in each half and ties the rest (2 / 4 wins)
+    assert(evaluate([-1, 0, 1, 0]) == False)
+
+    evaluator.args['evaluation_threshold'] = 0.5
+    assert(evaluate([-1, 0, 1, 0]) == True)